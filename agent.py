@@ -1,17 +1,40 @@
-from llm import get_agent_action
-from config import AGENT_MEMORY_SIZE, USE_MULTIMODAL
+import sys
+import pygame
+from collections import defaultdict, deque
+from llm import get_agent_action, get_cached_action, cache_action, forget_action
+from config import AGENT_MEMORY_SIZE, USE_MULTIMODAL, LLM_CACHE_ENERGY_BUCKET
 from pygame_visualization import render_grid_for_agent, surface_to_base64
 
+# (dx, dy) offsets for each move direction
+DIRECTIONS = {'up': (-1, 0), 'down': (1, 0), 'left': (0, -1), 'right': (0, 1)}
+
+# Food consumed by each eat action
+EAT_ACTIONS = {'eat red': 'red', 'eat green': 'green'}
+
+def build_agent_grid(agents):
+    """Index alive agents by the cell they occupy for constant-time neighbour lookups"""
+    grid = defaultdict(list)
+    for agent in agents:
+        if agent.alive:
+            grid[agent.position].append(agent)
+    return grid
+
 class Agent:
+    # Fixed attribute set: no per-agent __dict__, faster attribute access in the step loop
+    __slots__ = ('name', 'position', 'inventory', 'energy', 'alive', 'consumption_rates',
+                 '_type', 'actions_taken', 'memory', 'step_count')
+
     def __init__(self, name, start_pos=(4, 4)):
-        self.name = name
+        # Interned: cache keys and name-keyed dicts then compare names by identity
+        self.name = sys.intern(name)
         self.position = start_pos
         self.inventory = {'red': 1, 'green': 1}
         self.energy = 20
         self.alive = True
         self.consumption_rates = self.get_consumption_rates()
-        self.actions_taken = []  # Track history for debugging
-        self.memory = []  # Store recent memories for LLM context
+        self._type = self.get_agent_type()  # Rates never change, so neither does the type
+        self.actions_taken = deque(maxlen=5)  # Recent actions for debugging
+        self.memory = deque(maxlen=AGENT_MEMORY_SIZE)  # Store recent memories for LLM context
         self.step_count = 0
 
     def get_agent_type(self):
@@ -26,7 +49,7 @@ class Agent:
     @property
     def type(self):
         """Property to get agent type"""
-        return self.get_agent_type()
+        return self._type
 
     def get_consumption_rates(self):
         if self.name == "Agent1":
@@ -42,87 +65,148 @@ class Agent:
 
     def add_memory(self, observation, action_taken, result):
         """Add a structured memory entry and maintain memory limit"""
+        inventory = self.inventory
         memory_entry = (
-            f"Step {self.step_count}: "
-            f"Action: {action_taken} | "
-            f"Observation: {observation} | "
-            f"Outcome: {result} | "
-            f"Energy: {self.energy} | "
-            f"Inventory: {self.inventory}"
+            f"Step {self.step_count}: {action_taken} -> {result} | "
+            f"{observation} | "
+            f"Energy: {self.energy} | Inventory: R{inventory['red']} G{inventory['green']}"
         )
+        # Bounded deque drops the oldest memory once full
         self.memory.append(memory_entry)
-        # Keep only last N memories
-        if len(self.memory) > AGENT_MEMORY_SIZE:
-            self.memory = self.memory[-AGENT_MEMORY_SIZE:]
     
-    def get_current_observation(self, environment, all_agents):
-        """Generate current observation for memory"""
+    def count_nearby(self, environment, agent_grid):
+        """Count red food, green food and other agents in the 3x3 block around us"""
         x, y = self.position
-        cell_content = environment.get_cell_content(x, y)
-        
-        # Count nearby food and agents
         nearby_red = 0
         nearby_green = 0
         nearby_agents = 0
         
-        for dx in [-1, 0, 1]:
-            for dy in [-1, 0, 1]:
-                nx, ny = x + dx, y + dy
-                if 0 <= nx < environment.size and 0 <= ny < environment.size:
-                    if environment.get_cell_content(nx, ny) == 'red':
-                        nearby_red += 1
-                    elif environment.get_cell_content(nx, ny) == 'green':
-                        nearby_green += 1
+        # Clamp the 3x3 window to the grid once; both counts below stay inside it
+        size = environment.size
+        x0, x1 = max(0, x - 1), min(size, x + 2)
+        y0, y1 = max(0, y - 1), min(size, y + 2)
+
+        # Count each row of the window in one list.count call per food type
+        for row in environment.grid[x0:x1]:
+            window = row[y0:y1]
+            nearby_red += window.count('red')
+            nearby_green += window.count('green')
+        
+        # Only cells in the window can hold a neighbour
+        agents_at = agent_grid.get
+        for nx in range(x0, x1):
+            for ny in range(y0, y1):
+                for agent in agents_at((nx, ny), ()):
+                    if agent is not self:
+                        nearby_agents += 1
         
-        for agent in all_agents:
-            if agent.alive and agent.name != self.name:
-                ax, ay = agent.position
-                if abs(ax - x) <= 1 and abs(ay - y) <= 1:
-                    nearby_agents += 1
+        return nearby_red, nearby_green, nearby_agents
+
+    def get_current_observation(self, environment, agent_grid, nearby=None):
+        """Generate current observation for memory"""
+        x, y = self.position
+        cell_content = environment.get_cell_content(x, y)
+        if nearby is None:
+            nearby = self.count_nearby(environment, agent_grid)
+        nearby_red, nearby_green, nearby_agents = nearby
         
         cell_desc = cell_content if cell_content else "empty"
         return f"at {self.position}, cell has {cell_desc}, nearby: {nearby_red}R {nearby_green}G {nearby_agents}A, energy: {self.energy}"
 
-    def decide_and_act(self, environment, trade_manager=None, all_agents=[]):
+    def decide_and_act(self, environment, trade_manager=None, all_agents=[], agent_grid=None):
         if not self.alive:
             return "inactive"
 
+        if agent_grid is None:
+            agent_grid = build_agent_grid(all_agents)
+
+        turn = self.begin_turn(environment, agent_grid)
+        if turn is None:
+            return "ran out of energy"
+
+        return self.act(environment, turn, agent_grid, trade_manager=trade_manager, all_agents=all_agents)
+
+    def begin_turn(self, environment, agent_grid):
+        """Observe, pay this step's energy cost and prepare the decision context.
+
+        Returns None if the agent ran out of energy, otherwise the turn dict
+        that act() consumes.
+        """
         self.step_count += 1
-        current_observation = self.get_current_observation(environment, all_agents)
+        nearby = self.count_nearby(environment, agent_grid)
+        current_observation = self.get_current_observation(environment, agent_grid, nearby)
         
         self.energy -= 1
         if self.energy <= 0:
             self.alive = False
-            return "ran out of energy"
+            self._leave_grid(agent_grid, self.position)
+            return None
 
         x, y = self.position
         cell = environment.get_cell_content(x, y)
-        occupied_positions = {a.position for a in all_agents if a.alive and a.name != self.name}
 
-        # Generate visual input for multimodal model
+        # Agents keep revisiting the same local state; reuse the earlier decision for it
+        cache_key = (
+            self.name, self.position, self.inventory['red'], self.inventory['green'],
+            self.energy // LLM_CACHE_ENERGY_BUCKET, cell, nearby
+        )
+        return {'observation': current_observation, 'cell': cell, 'cache_key': cache_key}
+
+    def render_view(self, environment, all_agents, agent_grid=None):
+        """Generate visual input for multimodal model, or None if rendering fails"""
+        try:
+            if not pygame.get_init():
+                pygame.init()  # Initialise once, not for every agent every step
+            grid_surface = render_grid_for_agent(environment, self, all_agents, agent_grid)
+            return surface_to_base64(grid_surface)
+        except Exception as e:
+            print(f"Failed to generate visual input for {self.name}: {e}")
+            return None
+
+    def get_llm_inputs(self, turn):
+        """Arguments describing this agent's state to get_agent_action"""
+        return {
+            'agent_name': self.name,
+            'position': self.position,
+            'inventory': self.inventory,
+            'cell_content': turn['cell'],
+            'energy': self.energy,
+            'consumption_rate': self.consumption_rates,
+            'memory': self.memory,
+        }
+
+    def act(self, environment, turn, agent_grid, action=None, asked=False, trade_manager=None, all_agents=[]):
+        """Carry out a decision, asking the LLM again once if it can't be executed.
+
+        action is the first decision when it was already made for this agent
+        (e.g. in a batched request); otherwise the cache or the LLM supplies it.
+        asked means the LLM was already asked for this turn, so a missing action
+        becomes "do nothing" rather than a second request.
+        """
+        current_observation = turn['observation']
+        cache_key = turn['cache_key']
+        # Rendered on the first LLM call only; cached and batched decisions never need it
         grid_image_base64 = None
-        if USE_MULTIMODAL:
-            try:
-                import pygame
-                pygame.init()  # Ensure pygame is initialized
-                grid_surface = render_grid_for_agent(environment, self, all_agents)
-                grid_image_base64 = surface_to_base64(grid_surface)
-            except Exception as e:
-                print(f"Failed to generate visual input for {self.name}: {e}")
+        view_rendered = False
 
         retry_message = None
         for attempt in range(2):
-            action = get_agent_action(
-                agent_name=self.name,
-                position=self.position,
-                inventory=self.inventory,
-                cell_content=cell,
-                energy=self.energy,
-                consumption_rate=self.consumption_rates,
-                memory=self.memory,
-                grid_image_base64=grid_image_base64,
-                retry_message=retry_message
-            )
+            if retry_message is None:
+                action = action or get_cached_action(cache_key)
+            else:
+                action = None
+                asked = False  # A retry always asks again
+            if action is None and not asked:
+                if USE_MULTIMODAL and not view_rendered:
+                    grid_image_base64 = self.render_view(environment, all_agents, agent_grid)
+                    view_rendered = True
+                action = get_agent_action(
+                    **self.get_llm_inputs(turn),
+                    grid_image_base64=grid_image_base64,
+                    retry_message=retry_message
+                )
+            if retry_message is None and action:
+                cache_action(cache_key, action)
 
             # Defensive: Ensure action is always a string
             if not action:
@@ -134,8 +218,12 @@ class Agent:
             action_result = None
             if action.startswith("move"):
                 direction = action.split()[1]
-                moved = self.move(direction, environment.size, occupied_positions)
+                old_position = self.position
+                # Grid keys are exactly the occupied cells; our own cell is rejected by move()
+                moved = self.move(direction, environment.size, agent_grid)
                 if moved:
+                    self._leave_grid(agent_grid, old_position)
+                    agent_grid.setdefault(self.position, []).append(self)
                     action_result = f"moved {direction} (energy: {self.energy})"
                     self.add_memory(current_observation, action, "successful move")
                     return action_result
@@ -149,18 +237,12 @@ class Agent:
                 self.add_memory(current_observation, action, result)
                 return result
 
-            elif action == "eat red" and self.inventory['red'] > 0:
-                self.inventory['red'] -= 1
-                self.energy += self.consumption_rates['red']
-                action_result = f"ate red (+{self.consumption_rates['red']} energy)"
-                self.add_memory(current_observation, action, f"gained {self.consumption_rates['red']} energy")
-                return action_result
-
-            elif action == "eat green" and self.inventory['green'] > 0:
-                self.inventory['green'] -= 1
-                self.energy += self.consumption_rates['green']
-                action_result = f"ate green (+{self.consumption_rates['green']} energy)"
-                self.add_memory(current_observation, action, f"gained {self.consumption_rates['green']} energy")
+            elif (food := EAT_ACTIONS.get(action)) and self.inventory[food] > 0:
+                gain = self.consumption_rates[food]
+                self.inventory[food] -= 1
+                self.energy += gain
+                action_result = f"ate {food} (+{gain} energy)"
+                self.add_memory(current_observation, action, f"gained {gain} energy")
                 return action_result
 
             elif action == "do nothing":
@@ -178,10 +260,21 @@ class Agent:
                 retry_message = f"action '{action}' not possible"
                 action_result = "invalid action"
 
+            # Don't replay a decision that just failed in this state
+            forget_action(cache_key)
+
         # If we get here, both attempts failed
         self.add_memory(current_observation, "failed attempts", "no valid action found")
         return "failed to act"
 
+    def _leave_grid(self, agent_grid, position):
+        """Drop this agent from the grid bucket at position, removing the bucket once empty"""
+        bucket = agent_grid.get(position)
+        if bucket and self in bucket:
+            bucket.remove(self)
+            if not bucket:
+                del agent_grid[position]
+
     def handle_trade(self, action, trade_manager, all_agents):
         """Handle trading actions (placeholder for future implementation)"""
         # This could be expanded to handle complex trading logic
@@ -191,17 +284,13 @@ class Agent:
         return food_type in ['red', 'green']
 
     def move(self, direction, grid_size, occupied_positions):
-        x, y = self.position
-        new_pos = self.position
+        offset = DIRECTIONS.get(direction)
+        if offset is None:
+            return False
 
-        if direction == 'up':
-            new_pos = (max(0, x - 1), y)
-        elif direction == 'down':
-            new_pos = (min(grid_size - 1, x + 1), y)
-        elif direction == 'left':
-            new_pos = (x, max(0, y - 1))
-        elif direction == 'right':
-            new_pos = (x, min(grid_size - 1, y + 1))
+        x, y = self.position
+        dx, dy = offset
+        new_pos = (min(grid_size - 1, max(0, x + dx)), min(grid_size - 1, max(0, y + dy)))
 
         if new_pos not in occupied_positions and new_pos != self.position:
             self.position = new_pos
@@ -226,9 +315,9 @@ class Agent:
             'name': self.name,
             'type': self.type,
             'position': self.position,
-            'inventory': self.inventory,
+            'inventory': dict(self.inventory),  # Copy, so saved snapshots don't track the live dict
             'energy': self.energy,
             'alive': self.alive,
-            'last_actions': self.actions_taken[-5:] if self.actions_taken else [],
-            'recent_memories': self.memory[-3:] if self.memory else []
+            'last_actions': list(self.actions_taken),
+            'recent_memories': list(self.memory)[-3:]
         }
\ No newline at end of file
@@ -60,6 +60,12 @@ LLM_MODEL = "gpt-4o" #"gpt-3.5-turbo"
 LLM_TEMPERATURE = 0.7
 LLM_MAX_TOKENS = 50
 LLM_RETRY_ATTEMPTS = 2
+LLM_ACTION_CACHE_SIZE = 1024  # Decisions remembered for repeated local states (0 disables)
+LLM_CACHE_ENERGY_BUCKET = 5  # Energy levels within one bucket share a cached decision
+LLM_BATCH_ACTIONS = True  # Ask for all agents' actions in one LLM call per step (text mode only)
+# Opt-in: raise only for a backend that serves requests in parallel; requests queued
+# on a single local server still count against LOCAL_LLM_TIMEOUT
+LLM_MAX_WORKERS = 1  # Concurrent per-agent LLM requests when not batching (1 = one agent at a time)
 
 # Local LLM settings
 USE_LOCAL_LLM = True  # Set to True to use local LLM, False for OpenAI
@@ -72,6 +78,9 @@ LOCAL_LLM_TIMEOUT = 60  # Timeout in seconds for local LLM requests
 # Memory settings
 AGENT_MEMORY_SIZE = 3  # Number of past actions/observations to remember
 
+# Trading settings
+TRADE_HISTORY_SIZE = 500  # Most recent offers kept by the trade manager
+
 # Fallback behavior settings
 CRITICAL_ENERGY_THRESHOLD = 5  # Energy level to trigger emergency eating
 LOW_ENERGY_THRESHOLD = 10     # Energy level to prioritize eating
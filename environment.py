@@ -4,12 +4,15 @@ GRID_SIZE = 9
 FOOD_TYPES = ['red', 'green', None]
 
 class Environment:
-    def __init__(self):
+    def __init__(self, seed=None):
         self.size = GRID_SIZE
+        # Own generator: bound-method calls, and food layout can be seeded on its own
+        self.rng = random.Random(seed)
         self.grid = self._generate_grid()
 
     def _generate_grid(self):
-        return [[random.choice(FOOD_TYPES) for _ in range(self.size)] for _ in range(self.size)]
+        choice = self.rng.choice
+        return [[choice(FOOD_TYPES) for _ in range(self.size)] for _ in range(self.size)]
 
     def get_cell_content(self, x, y):
         return self.grid[x][y]
@@ -19,14 +22,12 @@ class Environment:
 
     def count_food(self):
         """Count total food in the environment"""
+        # list.count scans each row in C instead of comparing cell by cell here
         red_count = 0
         green_count = 0
         for row in self.grid:
-            for cell in row:
-                if cell == 'red':
-                    red_count += 1
-                elif cell == 'green':
-                    green_count += 1
+            red_count += row.count('red')
+            green_count += row.count('green')
         return {'red': red_count, 'green': green_count}
 
     def print_grid(self, agent_positions=[]):
@@ -50,13 +51,10 @@ class Environment:
     def fixed_replenish(self, red_count=5, green_count=5):
         """Replenish exactly red_count red and green_count green foods randomly."""
         empty_cells = [(x, y) for x in range(self.size) for y in range(self.size) if self.grid[x][y] is None]
-        random.shuffle(empty_cells)
-
-        for _ in range(red_count):
-            if empty_cells:
-                x, y = empty_cells.pop()
-                self.grid[x][y] = 'red'
-        for _ in range(green_count):
-            if empty_cells:
-                x, y = empty_cells.pop()
-                self.grid[x][y] = 'green'
\ No newline at end of file
+        # Draw only the cells we fill rather than shuffling every empty cell
+        chosen = self.rng.sample(empty_cells, min(len(empty_cells), red_count + green_count))
+
+        for x, y in chosen[:red_count]:
+            self.grid[x][y] = 'red'
+        for x, y in chosen[red_count:]:
+            self.grid[x][y] = 'green'
\ No newline at end of file
@@ -1,25 +1,71 @@
 import os
 import requests
 import json
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from dotenv import load_dotenv
 from openai import OpenAI
 from config import (
     USE_LOCAL_LLM, USE_MULTIMODAL, LOCAL_LLM_MODEL, MULTIMODAL_LLM_MODEL,
-    LOCAL_LLM_URL, LOCAL_LLM_TIMEOUT, AGENT_MEMORY_SIZE
+    LOCAL_LLM_URL, LOCAL_LLM_TIMEOUT, AGENT_MEMORY_SIZE, LLM_ACTION_CACHE_SIZE
 )
 
 load_dotenv()
 api_key = os.getenv('OPENAI_API_KEY')
 
 LOG_FILE = "llm_logs.txt"
+_log_lock = threading.Lock()
+
+VALID_ACTIONS = ('move up', 'move down', 'move left', 'move right',
+                 'collect', 'eat red', 'eat green', 'do nothing')
+
+# Reply budget per agent in a batched request ("AgentN": "move right", ...)
+BATCH_TOKENS_PER_AGENT = 16
+
+BATCH_SYSTEM_PROMPT = """You control several 🤖 agents on a 9x9 grid. Each agent loses 1 ⚡ every step.
+
+Each agent can do ONE of the following actions:
+- 🚶 Move: 'move up', 'move down', 'move left', 'move right'
+- 🍽️ Collect food at its cell: 'collect'
+- 🍴 Eat food from its inventory: 'eat red' or 'eat green'
+- 😴 Do nothing: 'do nothing'
+
+🎯 Goal: Keep every agent alive as long as possible by collecting and eating food to keep its energy above 0. Prioritize actions that maximize survival.
+
+Reply with only a JSON object mapping each agent's name to its action, e.g. {"Agent1": "collect", "Agent2": "move up"}."""
 
 def log(prompt, response):
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
+    # Requests may run on several threads; keep each entry contiguous
+    with _log_lock, open(LOG_FILE, "a", encoding="utf-8") as f:
         f.write("\n" + "="*40 + "\n")
         f.write("Prompt:\n" + prompt.strip() + "\n")
         f.write("Response:\n" + response.strip() + "\n")
 
-def call_local_llm(prompt):
+# LRU cache of decisions keyed by an agent's local state
+_action_cache = OrderedDict()
+
+def get_cached_action(key):
+    """Return the action cached for key, or None on a miss"""
+    action = _action_cache.get(key)
+    if action is not None:
+        _action_cache.move_to_end(key)
+    return action
+
+def cache_action(key, action):
+    """Remember action for key, evicting the least recently used entry when full"""
+    if LLM_ACTION_CACHE_SIZE <= 0:
+        return
+    _action_cache[key] = action
+    _action_cache.move_to_end(key)
+    if len(_action_cache) > LLM_ACTION_CACHE_SIZE:
+        _action_cache.popitem(last=False)
+
+def forget_action(key):
+    """Drop a cached action, e.g. after it failed to execute"""
+    _action_cache.pop(key, None)
+
+def call_local_llm(prompt, system=None, max_tokens=50, json_output=False):
     """Call local LLM via Ollama API"""
     try:
         payload = {
@@ -28,10 +74,16 @@ def call_local_llm(prompt):
             "stream": False,
             "options": {
                 "temperature": 0.7,
-                "num_predict": 50,
+                "num_predict": max_tokens,
                 "stop": ["\n", ".", "Action:"]
             }
         }
+        if system:
+            payload["system"] = system
+        if json_output:
+            # A JSON reply spans lines and sentences, so let the format constraint end it
+            payload["format"] = "json"
+            del payload["options"]["stop"]
         response = requests.post(
             f"{LOCAL_LLM_URL}/api/generate",
             json=payload,
@@ -53,7 +105,7 @@ def call_local_llm(prompt):
         print(f"Local LLM error: {str(e)}")
         return None
 
-def call_multimodal_llm(prompt, image_base64):
+def call_multimodal_llm(prompt, image_base64, system=None):
     """Call multimodal LLM (LLaVA) via Ollama API with image input"""
     try:
         payload = {
@@ -67,6 +119,8 @@ def call_multimodal_llm(prompt, image_base64):
                 "stop": ["\n", ".", "Action:"]
             }
         }
+        if system:
+            payload["system"] = system
         response = requests.post(
             f"{LOCAL_LLM_URL}/api/generate",
             json=payload,
@@ -82,54 +136,56 @@ def call_multimodal_llm(prompt, image_base64):
         print(f"Multimodal LLM error: {str(e)}")
         return None
 
-def call_openai_llm(prompt):
+def call_openai_llm(prompt, system=None, max_tokens=50, json_output=False):
     """Call OpenAI API"""
     try:
         client = OpenAI(api_key=api_key)
+        messages = [{"role": "user", "content": prompt}]
+        if system:
+            messages.insert(0, {"role": "system", "content": system})
+        extra_args = {}
+        if json_output:
+            extra_args["response_format"] = {"type": "json_object"}
         response = client.chat.completions.create(
             model="gpt-3.5-turbo",
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=50,
-            temperature=0.7
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=0.7,
+            **extra_args
         )
         return response.choices[0].message.content.strip().lower()
     except Exception as e:
         print(f"OpenAI API error: {str(e)}")
         return None
 
-def get_agent_action(
-    agent_name,
-    position,
-    inventory,
-    cell_content,
-    energy,
-    consumption_rate,
-    memory=None,
-    grid_image_base64=None,
-    retry_message=None,
-):
-    # Build memory context
+def format_memory(memory):
+    """Number the most recent memories for a prompt"""
     memory_context = ""
     if memory and len(memory) > 0:
-        memory_context = ""
-        for i, mem in enumerate(memory[-AGENT_MEMORY_SIZE:], 1):
+        for i, mem in enumerate(list(memory)[-AGENT_MEMORY_SIZE:], 1):
             memory_context += f"{i}. {mem}\n"
     else:
         memory_context = "None"
+    return memory_context
 
-    # Build emoji-rich prompt
-    base_prompt = f"""You are 🤖 Agent {agent_name} at position {position} on a 9x9 grid.
-Your current energy is {energy} ⚡. You lose 1 ⚡ each step.
-Your inventory: {inventory}
-The cell you are on contains: {cell_content if cell_content else 'nothing'}.
+def match_action(action):
+    """Map a model reply onto one of VALID_ACTIONS, or None if it names none"""
+    for valid in VALID_ACTIONS:
+        if action.startswith(valid):
+            return valid
+    return None
 
-🍎 Red food gives you {consumption_rate.get('red', 0)} ⚡.
-🥦 Green food gives you {consumption_rate.get('green', 0)} ⚡.
+@lru_cache(maxsize=None)
+def build_system_prompt(agent_name, red_rate, green_rate, visual=False):
+    """Build the per-agent instructions that stay identical across turns.
 
-Your recent memories:
-{memory_context}
+    Providers reuse the processed prefix of a prompt they have seen before, so
+    everything that doesn't change between turns goes first and is built once.
+    """
+    prompt = f"""You are 🤖 Agent {agent_name} on a 9x9 grid. You lose 1 ⚡ each step.
+
+🍎 Red food gives you {red_rate} ⚡.
+🥦 Green food gives you {green_rate} ⚡.
 
 You can do ONE of the following actions (reply with just the action):
 - 🚶 Move: 'move up', 'move down', 'move left', 'move right'
@@ -141,9 +197,9 @@ You can do ONE of the following actions (reply with just the action):
 
 Reply with only one valid action from the list above."""
 
-    # Add visual context if multimodal
-    if USE_MULTIMODAL and grid_image_base64:
-        visual_prompt = f"""
+    if visual:
+        prompt += """
+
 Look at the image showing the grid around you. In the image:
 - 🍎 Red circles = red food
 - 🥦 Green circles = green food  
@@ -151,49 +207,130 @@ Look at the image showing the grid around you. In the image:
 - 🟡 Yellow circle with black border = you
 - ⬜ White squares = empty cells
 
-Use this visual information along with the text description to make your decision.
+Use this visual information along with the text description to make your decision."""
+    return prompt
 
-{base_prompt}"""
-        prompt = visual_prompt
-    else:
-        prompt = base_prompt
+def get_agent_action(
+    agent_name,
+    position,
+    inventory,
+    cell_content,
+    energy,
+    consumption_rate,
+    memory=None,
+    grid_image_base64=None,
+    retry_message=None,
+):
+    memory_context = format_memory(memory)
+
+    red_rate, green_rate = consumption_rate.get('red', 0), consumption_rate.get('green', 0)
+    system_prompt = build_system_prompt(agent_name, red_rate, green_rate)
+
+    # Per-turn state only, so the system prompt above stays a stable prefix
+    inventory_desc = ", ".join(f"{food}: {count}" for food, count in sorted(inventory.items()))
+    prompt = f"""You are at position {position}.
+Your current energy is {energy} ⚡.
+Your inventory: {inventory_desc}
+The cell you are on contains: {cell_content if cell_content else 'nothing'}.
+
+Your recent memories:
+{memory_context}"""
 
     if retry_message:
         prompt += f"\n⚠️ Note: Your previous action failed because: {retry_message}. Try something different."
 
+    logged_prompt = f"{system_prompt}\n\n{prompt}"
+
     # Try multimodal LLM first if enabled and image available
     action = None
     if USE_MULTIMODAL and grid_image_base64 and USE_LOCAL_LLM:
-        action = call_multimodal_llm(prompt, grid_image_base64)
+        visual_system_prompt = build_system_prompt(agent_name, red_rate, green_rate, visual=True)
+        action = call_multimodal_llm(prompt, grid_image_base64, system=visual_system_prompt)
         if action:
             action = action.lower()
-            log(prompt, f"[MULTIMODAL LLM] {action}")
+            log(f"{visual_system_prompt}\n\n{prompt}", f"[MULTIMODAL LLM] {action}")
 
     # Try local text LLM if multimodal failed or not enabled
     if not action and USE_LOCAL_LLM:
-        action = call_local_llm(base_prompt)
+        action = call_local_llm(prompt, system=system_prompt)
         if action:
             action = action.lower()
-            log(base_prompt, f"[LOCAL LLM] {action}")
+            log(logged_prompt, f"[LOCAL LLM] {action}")
 
     # Fallback to OpenAI if local LLM failed or is disabled
     if not action and api_key:
-        action = call_openai_llm(base_prompt)
+        action = call_openai_llm(prompt, system=system_prompt)
         if action:
-            log(base_prompt, f"[OPENAI] {action}")
+            log(logged_prompt, f"[OPENAI] {action}")
 
-    # If all LLMs failed, do nothing
+    # If all LLMs failed, the agent does nothing; None keeps that out of the action cache
     if not action:
-        log(base_prompt, "[NO ACTION] All LLMs failed, agent does nothing.")
-        return "do nothing"
+        log(logged_prompt, "[NO ACTION] All LLMs failed, agent does nothing.")
+        return None
 
-    # Check for valid actions
-    valid_actions = ['move up', 'move down', 'move left', 'move right',
-                     'collect', 'eat red', 'eat green', 'do nothing']
+    return match_action(action)
 
-    for valid in valid_actions:
-        if action.startswith(valid):
-            return valid
+def get_agent_actions_batch(agent_inputs):
+    """Ask for the next action of several agents in a single LLM call.
 
-    # Default fallback
-    return
\ No newline at end of file
+    agent_inputs holds one dict per agent with the state arguments of
+    get_agent_action. Returns one action per input, in order; an entry is None
+    when the reply had no valid action for that agent so the caller can fall
+    back to asking it on its own.
+    """
+    if not agent_inputs:
+        return []
+
+    sections = []
+    for inputs in agent_inputs:
+        rates = inputs['consumption_rate']
+        inventory = inputs['inventory']
+        inventory_desc = ", ".join(f"{food}: {count}" for food, count in sorted(inventory.items()))
+        cell_content = inputs['cell_content']
+        sections.append(f"""### {inputs['agent_name']}
+Red food gives {rates.get('red', 0)} ⚡, green food gives {rates.get('green', 0)} ⚡.
+Position: {inputs['position']}
+Energy: {inputs['energy']} ⚡
+Inventory: {inventory_desc}
+The cell contains: {cell_content if cell_content else 'nothing'}.
+Recent memories:
+{format_memory(inputs['memory'])}""")
+    prompt = "\n\n".join(sections)
+    logged_prompt = f"{BATCH_SYSTEM_PROMPT}\n\n{prompt}"
+    max_tokens = BATCH_TOKENS_PER_AGENT * len(agent_inputs) + 10
+
+    reply = None
+    if USE_LOCAL_LLM:
+        reply = call_local_llm(prompt, system=BATCH_SYSTEM_PROMPT, max_tokens=max_tokens, json_output=True)
+        if reply:
+            log(logged_prompt, f"[LOCAL LLM BATCH] {reply}")
+
+    if not reply and api_key:
+        reply = call_openai_llm(prompt, system=BATCH_SYSTEM_PROMPT, max_tokens=max_tokens, json_output=True)
+        if reply:
+            log(logged_prompt, f"[OPENAI BATCH] {reply}")
+
+    if not reply:
+        log(logged_prompt, "[NO ACTION] Batch request failed, agents will be asked one by one.")
+        return [None] * len(agent_inputs)
+
+    decisions = parse_batch_reply(reply)
+    actions = []
+    for inputs in agent_inputs:
+        action = decisions.get(inputs['agent_name'].lower())
+        actions.append(match_action(action) if action else None)
+    return actions
+
+def parse_batch_reply(reply):
+    """Read the agent name -> action object from a batch reply, ignoring text around it"""
+    start, end = reply.find("{"), reply.rfind("}")
+    if start == -1 or end < start:
+        return {}
+    try:
+        decisions = json.loads(reply[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(decisions, dict):
+        return {}
+    # Names are matched case-insensitively since some providers lower-case the reply
+    return {str(name).strip().lower(): str(action).strip().lower() for name, action in decisions.items()}
\ No newline at end of file
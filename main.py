@@ -3,17 +3,80 @@ import random
 import sys
 import json
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from environment import Environment
-from agent import Agent
+from agent import Agent, build_agent_grid
+from llm import get_agent_action, get_agent_actions_batch, get_cached_action
+from config import LLM_BATCH_ACTIONS, LLM_MAX_WORKERS, USE_MULTIMODAL
 from pygame_visualization import draw_grid
 
 def generate_unique_positions(num_agents, grid_size):
-    positions = set()
-    while len(positions) < num_agents:
-        x = random.randint(0, grid_size - 1)
-        y = random.randint(0, grid_size - 1)
-        positions.add((x, y))
-    return list(positions)
+    # Sample distinct cell indices directly; no retries however full the grid gets
+    cells = random.sample(range(grid_size * grid_size), num_agents)
+    return [divmod(cell, grid_size) for cell in cells]
+
+def begin_turns(env, living, agent_grid):
+    """Begin the step for every agent in living.
+
+    Returns the (agent, turn) pairs still to act, the agents that ran out of
+    energy, and the pairs with no cached decision that need the LLM.
+    """
+    turns = []
+    starved = []
+    for agent in living:
+        turn = agent.begin_turn(env, agent_grid)
+        if turn is None:
+            starved.append(agent)
+        else:
+            turns.append((agent, turn))
+    pending = [(agent, turn) for agent, turn in turns if get_cached_action(turn['cache_key']) is None]
+    return turns, starved, pending
+
+def act_batched(env, agents, living, agent_grid):
+    """Run one step for the living agents with a single LLM request.
+
+    Every agent observes and pays its energy cost first, the agents without a
+    cached decision are asked together, and the actions are then applied in
+    list order so move conflicts resolve as in the sequential loop. Yields
+    (agent, result) pairs.
+    """
+    turns, starved, pending = begin_turns(env, living, agent_grid)
+    for agent in starved:
+        yield agent, "ran out of energy"
+
+    actions = get_agent_actions_batch([agent.get_llm_inputs(turn) for agent, turn in pending])
+    decided = {agent.name: action for (agent, _), action in zip(pending, actions)}
+
+    for agent, turn in turns:
+        yield agent, agent.act(env, turn, agent_grid, action=decided.get(agent.name), all_agents=agents)
+
+def act_concurrently(env, agents, living, agent_grid):
+    """Run one step with the agents' LLM requests in flight at the same time.
+
+    Used when decisions can't be batched. Requests are network-bound, so a
+    thread pool overlaps them; rendering and applying the actions stay on this
+    thread, in list order. Yields (agent, result) pairs.
+    """
+    turns, starved, pending = begin_turns(env, living, agent_grid)
+    for agent in starved:
+        yield agent, "ran out of energy"
+
+    llm_requests = []
+    for agent, turn in pending:
+        grid_image_base64 = agent.render_view(env, agents, agent_grid) if USE_MULTIMODAL else None
+        llm_requests.append(dict(agent.get_llm_inputs(turn), grid_image_base64=grid_image_base64))
+    with ThreadPoolExecutor(max_workers=LLM_MAX_WORKERS) as pool:
+        actions = list(pool.map(lambda inputs: get_agent_action(**inputs), llm_requests))
+    decided = {agent.name: action for (agent, _), action in zip(pending, actions)}
+
+    # Pending agents were asked already; a reply with no action means "do nothing"
+    for agent, turn in turns:
+        yield agent, agent.act(
+            env, turn, agent_grid, action=decided.get(agent.name), asked=agent.name in decided, all_agents=agents
+        )
+
+# Snapshots already on disk per stats file, loaded once instead of on every save
+_saved_stats = {}
 
 def save_game_stats(agents, step, filename="game_stats.json"):
     """Save game statistics for analysis"""
@@ -24,11 +87,14 @@ def save_game_stats(agents, step, filename="game_stats.json"):
         'alive_count': sum(1 for agent in agents if agent.alive)
     }
     
-    try:
-        with open(filename, 'r') as f:
-            all_stats = json.load(f)
-    except:
-        all_stats = []
+    all_stats = _saved_stats.get(filename)
+    if all_stats is None:
+        try:
+            with open(filename, 'r') as f:
+                all_stats = json.load(f)
+        except:
+            all_stats = []
+        _saved_stats[filename] = all_stats
     
     all_stats.append(stats)
     
@@ -54,6 +120,9 @@ def main():
     positions = generate_unique_positions(num_agents, env.size)
     agents = [Agent(f"Agent{i+1}", start_pos=positions[i]) for i in range(num_agents)]
 
+    # Built once: agents update it themselves whenever they move or die
+    agent_grid = build_agent_grid(agents)
+
     steps = 0
     total_steps = 50
     running = True
@@ -78,14 +147,23 @@ def main():
 
         # Count alive agents
         print(f"\n--- Step {steps + 1} ---")
-        alive_count = sum(1 for agent in agents if agent.alive)
+        # Agents only die on their own turn, so one alive filter serves the whole step
+        living = [agent for agent in agents if agent.alive]
+        alive_count = len(living)
         print(f"Alive agents: {alive_count}/{num_agents}")
         
         # Agent actions
-        for agent in agents:
-            if agent.alive:
-                action = agent.decide_and_act(env, all_agents=agents)
-                print(f"{agent.name} at {agent.position} (energy: {agent.energy}): {action}")
+        if LLM_BATCH_ACTIONS and not USE_MULTIMODAL:
+            step_results = act_batched(env, agents, living, agent_grid)
+        elif LLM_MAX_WORKERS > 1:
+            step_results = act_concurrently(env, agents, living, agent_grid)
+        else:
+            step_results = (
+                (agent, agent.decide_and_act(env, all_agents=agents, agent_grid=agent_grid))
+                for agent in living
+            )
+        for agent, action in step_results:
+            print(f"{agent.name} at {agent.position} (energy: {agent.energy}): {action}")
         
         # Check for game over
         if alive_count == 0:
@@ -3,6 +3,11 @@ import io
 import base64
 from config import *
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 def draw_grid(screen, env, agents, font, sub_font):
     screen.fill(COLORS['GRID'])
 
@@ -63,8 +68,12 @@ def draw_grid(screen, env, agents, font, sub_font):
 
     pygame.display.flip()
 
-def render_grid_for_agent(env, agent, all_agents):
-    """Render a small grid image centered on the agent for multimodal LLM"""
+def render_grid_for_agent(env, agent, all_agents, agent_grid=None):
+    """Render a small grid image centered on the agent for multimodal LLM.
+
+    agent_grid, the position -> agents index, limits the agent lookup to the
+    cells in view; without it every agent is checked.
+    """
     # Create a smaller surface for the agent's view
     view_size = 5  # 5x5 grid around agent
     cell_size = 40  # Smaller cells for LLM processing
@@ -101,8 +110,18 @@ def render_grid_for_agent(env, agent, all_agents):
                 pygame.draw.circle(surface, color, (center_x, center_y), radius)
     
     # Draw other agents in view
-    for other_agent in all_agents:
-        if not other_agent.alive or other_agent.name == agent.name:
+    if agent_grid is not None:
+        # Lazily walk the cells in view; the agents are only iterated once
+        visible_agents = (
+            other_agent
+            for i in range(start_x, end_x)
+            for j in range(start_y, end_y)
+            for other_agent in agent_grid.get((i, j), ())
+        )
+    else:
+        visible_agents = all_agents
+    for other_agent in visible_agents:
+        if other_agent is agent or not other_agent.alive:
             continue
             
         other_x, other_y = other_agent.position
@@ -127,23 +146,20 @@ def surface_to_base64(surface):
     img_size = surface.get_size()
     
     # Create PIL Image and convert to base64
-    try:
-        from PIL import Image
-        import io
-        
-        # Convert pygame surface to PIL Image
-        img = Image.frombytes('RGB', img_size, img_str)
-        
-        # Convert to base64
-        buffered = io.BytesIO()
-        img.save(buffered, format="PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode()
-        
-        return img_base64
-    except ImportError:
+    if Image is None:
         print("PIL not available for image conversion. Install with: pip install Pillow")
         return None
 
+    # Convert pygame surface to PIL Image
+    img = Image.frombytes('RGB', img_size, img_str)
+    
+    # Convert to base64
+    buffered = io.BytesIO()
+    img.save(buffered, format="PNG")
+    img_base64 = base64.b64encode(buffered.getvalue()).decode()
+    
+    return img_base64
+
 def draw_stats_overlay(screen, env, agents, font):
     """Draw statistics overlay (optional feature)"""
     overlay_height = 100
@@ -1,33 +1,47 @@
+from collections import deque
+from dataclasses import dataclass
+from config import TRADE_HISTORY_SIZE
+
+@dataclass(slots=True)
+class TradeOffer:
+    """An agent's offer to give some food in exchange for other food"""
+    id: int
+    from_agent: str
+    give: dict
+    want: dict
+    status: str = 'open'
+
 class TradeManager:
     def __init__(self):
-        self.offers = []
+        self.offers = deque(maxlen=TRADE_HISTORY_SIZE)  # Recent offers, oldest dropped first
+        self._open_offers = {}  # id -> offer, for offers still open
         self.next_offer_id = 1
 
     def make_offer(self, from_agent, give: dict, want: dict):
-        offer = {
-            'id': self.next_offer_id,
-            'from': from_agent.name,
-            'give': give,
-            'want': want,
-            'status': 'open'
-        }
+        offer = TradeOffer(self.next_offer_id, from_agent.name, give, want)
         self.offers.append(offer)
+        self._open_offers[offer.id] = offer
         self.next_offer_id += 1
         return offer
 
     def get_open_offers(self, excluding_agent=None):
         return [
-            o for o in self.offers
-            if o['status'] == 'open' and o['from'] != excluding_agent
+            o for o in self._open_offers.values()
+            if o.from_agent != excluding_agent
         ]
 
     def accept_offer(self, offer_id, to_agent):
-        offer = next((o for o in self.offers if o['id'] == offer_id and o['status'] == 'open'), None)
+        offer = self._open_offers.pop(offer_id, None)
         if not offer:
             return "Offer not found or already accepted."
 
-        offer['status'] = 'accepted'
+        offer.status = 'accepted'
         return offer
 
     def list_offers(self):
-        return self.offers
+        return list(self.offers)
+
+    @property
+    def total_offers(self):
+        """Number of offers ever made, including those no longer in the history"""
+        return self.next_offer_id - 1